@@ -1,20 +1,269 @@
+import asyncio
+import logging
 import os
 import re
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+import anyio.from_thread
+import anyio.to_thread
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 import spacy
+from spacy.language import Language
+from spacy.tokens import Doc
 
 # --- Config
 MODEL = os.getenv("SPACY_MODEL_FR", "fr_core_news_md")
 MAX_CHARS = int(os.getenv("SPACY_MAX_CHARS", "120000"))
 DEBUG_DEFAULT = os.getenv("SPACY_DEBUG_DEFAULT", "false").lower() == "true"
+BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", "16"))
+BATCH_DELAY = float(os.getenv("SPACY_BATCH_DELAY_MS", "20")) / 1000.0
+# GPU needs the CUDA image (Dockerfile.gpu) and is only worth it with
+# real batches: keep SPACY_BATCH_SIZE >= 16 when enabling it.
+USE_GPU = os.getenv("SPACY_USE_GPU", "false").lower() == "true"
+ORG_CACHE_SIZE = int(os.getenv("SPACY_ORG_CACHE_SIZE", "4096"))
+# nlp.pipe() calls run in parallel threads, shared by all batchers (spaCy releases the
+# GIL in its hot loops). Defaults to this worker's share of the cores, so that
+# WEB_CONCURRENCY workers x SPACY_NLP_THREADS doesn't exceed them.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY") or "1"))
+NLP_THREADS = int(os.getenv("SPACY_NLP_THREADS") or max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY))
+
+# Threading contract:
+# nlp() and everything done with its Docs (entity / token loops, dict building,
+# cleaning 100k-char texts) is CPU-bound. Route handlers stay plain `def` so
+# Starlette runs all of it in the anyio threadpool, never on the event loop;
+# they reach the batchers with `anyio.from_thread.run(batcher.submit, text)`.
+# Batchers run nlp.pipe() in their own threads (not the default threadpool), so
+# handler threads blocked waiting on a batch can't starve them; NLP_SLOTS caps
+# the ones actually inside spaCy at SPACY_NLP_THREADS across both batchers.
+# Keep the default threadpool (40) well above SPACY_BATCH_SIZE: each waiting
+# request holds a thread.
+# A handler that needs several docs (e.g. title + company) must submit them
+# concurrently, from one coroutine doing `asyncio.gather(batcher.submit(a), org_batcher.submit(b))`,
+# not one after the other: they then run in parallel threads / the same batch.
+
+# Only NER (+ lexical attrs like is_stop / is_punct) is used: skip the rest of the pipeline.
+DISABLED_PIPES = ["tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer"]
+
+log = logging.getLogger("uvicorn.error")
+
+@lru_cache(maxsize=1)
+def get_nlp() -> Language:
+    """Load the model once per process, whatever the import order (a reload costs seconds and 100s of MB)."""
+    if USE_GPU:
+        spacy.require_gpu()
+    m = spacy.load(MODEL, disable=DISABLED_PIPES)
+    # routes reject > MAX_CHARS with a 413; keep spaCy's own limit (default 1e6) right above it
+    m.max_length = MAX_CHARS + 1024
+    return m
+
+# Loaded at import: under gunicorn --preload every worker shares these (read-only) weights.
+LOAD_TS = time.time()
+nlp = get_nlp()
 
-app = FastAPI(title="candiqo-spacy", version="0.3.0")
+# ------------------------
+# Dynamic batching
+# ------------------------
+
+# process-wide, unlike the per-loop limiters: one budget for every batcher and loop
+NLP_SLOTS = threading.BoundedSemaphore(max(1, NLP_THREADS))
+
+
+class _LoopState:
+    """Queue, slots and thread limiter of one DynBatcher on one event loop."""
+
+    def __init__(self, max_workers: int):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # slots bound in-flight batches; the limiter gives each one a thread without
+        # touching the default threadpool limiter (held by handlers waiting on us)
+        self.slots = asyncio.Semaphore(max_workers)
+        self.limiter = anyio.CapacityLimiter(max_workers)
+        self.inflight: set = set()
+        self.task: Optional[asyncio.Task] = None
 
-LOAD_TS = time.time()
-nlp = spacy.load(MODEL)
+
+class DynBatcher:
+    """
+    Collect texts from concurrent requests and run them through nlp.pipe() together.
+    A batch is flushed when it holds max_batch_size texts or max_delay seconds
+    after its first text arrived, whichever comes first.
+    Started lazily by the first submit() on each running loop (no lifespan needed);
+    the lifespan only stops it on shutdown.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_batch_size: int = BATCH_SIZE,
+        max_delay: float = BATCH_DELAY,
+        max_workers: int = NLP_THREADS,
+    ):
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max(0.0, max_delay)
+        self.max_workers = max(1, max_workers)
+        # one state per loop: a TestClient used without `with` runs each request on
+        # its own short-lived loop, possibly several at once from different threads
+        self._states: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
+        self._states_lock = threading.Lock()
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        with self._states_lock:
+            st = self._states.get(loop)
+            if st is None:
+                # forget loops that were closed without a lifespan shutdown
+                for old in [l for l in self._states if l.is_closed()]:
+                    del self._states[old]
+            if st is None or st.task.done():
+                st = _LoopState(self.max_workers)
+                st.task = loop.create_task(self._run(st), name=f"batcher:{self.name}")
+                self._states[loop] = st
+        return st
+
+    async def stop(self) -> None:
+        with self._states_lock:
+            st = self._states.pop(asyncio.get_running_loop(), None)
+        if st is None:
+            return
+        st.task.cancel()
+        for task in list(st.inflight):
+            task.cancel()
+        await asyncio.gather(st.task, *st.inflight, return_exceptions=True)
+        # nothing drains this queue any more: don't leave its callers hanging
+        while not st.queue.empty():
+            _, fut = st.queue.get_nowait()
+            fut.cancel()
+
+    async def submit(self, text: str) -> Doc:
+        st = self._state()
+        fut = asyncio.get_running_loop().create_future()
+        await st.queue.put((text, fut))
+        return await fut
+
+    async def _collect(self, queue: asyncio.Queue) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _pipe(self, texts: List[str]) -> List[Doc]:
+        with NLP_SLOTS:
+            return list(nlp.pipe(texts, batch_size=self.max_batch_size))
+
+    async def _run(self, st: _LoopState) -> None:
+        while True:
+            # wait for a free worker before collecting: meanwhile the queue keeps filling
+            await st.slots.acquire()
+            try:
+                batch = await self._collect(st.queue)
+            except BaseException:
+                st.slots.release()
+                raise
+            task = asyncio.create_task(self._process(batch, st.slots, st.limiter))
+            st.inflight.add(task)
+            task.add_done_callback(st.inflight.discard)
+
+    async def _process(
+        self, batch: list, slots: asyncio.Semaphore, limiter: anyio.CapacityLimiter
+    ) -> None:
+        try:
+            # a future is already done only if its submit() was cancelled
+            # (loop shutting down): skip those texts
+            batch = [(t, f) for t, f in batch if not f.done()]
+            if not batch:
+                return
+            try:
+                docs = await anyio.to_thread.run_sync(
+                    self._pipe, [t for t, _ in batch], limiter=limiter
+                )
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            for (_, fut), doc in zip(batch, docs):
+                if not fut.done():
+                    fut.set_result(doc)
+        finally:
+            slots.release()
+
+# Full texts (debug / extract) and short company queries are batched separately
+# so a 3-word query never waits behind a 100k-char paste.
+batcher = DynBatcher("text")
+org_batcher = DynBatcher("org")
+
+# ------------------------
+# Caching
+# ------------------------
+
+_MISS = object()
+
+class LRUCache:
+    """
+    Small bounded LRU with hit/miss counters.
+    functools.lru_cache can't be used on coroutines (it would cache the coroutine object).
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(0, maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        """Return the cached value, or _MISS."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return _MISS
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        if not self.maxsize:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def info(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+# company names are Zipf-distributed across CVs; only the best ORG string is kept, never the Doc
+org_cache = LRUCache(ORG_CACHE_SIZE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log.info("spaCy model %s loaded (gpu=%s), active pipes: %s", MODEL, USE_GPU, nlp.pipe_names)
+    try:
+        yield
+    finally:
+        await batcher.stop()
+        await org_batcher.stop()
+
+app = FastAPI(
+    title="candiqo-spacy",
+    version="0.3.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # ------------------------
 # Regex / helpers
@@ -23,27 +272,32 @@ nlp = spacy.load(MODEL)
 RX_MD_HEADING = re.compile(r"^#{1,6}\s+")
 RX_PIPE = re.compile(r"\|")
 RX_DASH_SPLIT = re.compile(r"\s[-—–]\s")
-RX_PARENS = re.compile(r"\((.*?)\)")
 RX_MULTI_SPACE = re.compile(r"\s{2,}")
 RX_MAILTO = re.compile(r"\bmailto:\s*", re.I)
 
 # Date-ish tokens (loose; only used to FIND/ISOLATE a raw range, not parse)
-MONTHS_FR = r"(janv\.?|janvier|f[eé]v\.?|f[eé]vr\.?|f[eé]vrier|mars|avr\.?|avril|mai|juin|juil\.?|juillet|ao[uû]t|sept\.?|septembre|oct\.?|octobre|nov\.?|novembre|d[eé]c\.?|d[eé]cembre)"
-MONTHS_EN = r"(jan\.?|january|feb\.?|february|mar\.?|march|apr\.?|april|may|jun\.?|june|jul\.?|july|aug\.?|august|sep\.?|sept\.?|september|oct\.?|october|nov\.?|november|dec\.?|december)"
-RX_YEAR = re.compile(r"\b(19\d{2}|20\d{2})\b")
-RX_MMYYYY = re.compile(r"\b(0?[1-9]|1[0-2])\s*[\/\.-]\s*(19\d{2}|20\d{2})\b")
-RX_PRESENT = re.compile(r"\b(pr[eé]sent|present|actuel|actuellement|aujourd['’]hui|en\s*cours|current|now|today)\b", re.I)
+# FR + EN month names/abbreviations in one non-capturing alternation. Groups are
+# all non-capturing and no two adjacent \s* can split the same whitespace run,
+# which keeps backtracking bounded on long or adversarial lines.
+MONTHS = (
+    r"(?:janv(?:ier)?|jan(?:uary)?|f[eé]v(?:r(?:ier)?)?|feb(?:ruary)?|mars?|march|avr(?:il)?|apr(?:il)?"
+    r"|mai|may|juin|june?|juil(?:let)?|july?|ao[uû]t|aug(?:ust)?|sept?(?:embre|ember)?"
+    r"|oct(?:obre|ober)?|nov(?:embre|ember)?|d[eé]c(?:embre|ember)?)\.?"
+)
+RX_YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+RX_MMYYYY = re.compile(r"\b(?:0?[1-9]|1[0-2])\s*[\/\.-]\s*(?:19|20)\d{2}\b")
+RX_PRESENT = re.compile(r"\b(?:pr[eé]sent|actuel(?:lement)?|aujourd['’]hui|en\s*cours|current|now|today)\b", re.I)
 
 # very tolerant range detector (keeps raw)
 RX_DATE_RANGE = re.compile(
-    rf"(?P<range>(?:{MONTHS_FR}|{MONTHS_EN})?\s*{RX_YEAR.pattern}"
+    rf"(?:{MONTHS}\s*)?{RX_YEAR.pattern}"
     rf"\s*(?:[-–—]|to|\bà\b|\bau\b|\bjusqu)\s*"
-    rf"(?:(?:{MONTHS_FR}|{MONTHS_EN})?\s*)?(?:{RX_YEAR.pattern}|{RX_PRESENT.pattern}))",
+    rf"(?:{MONTHS}\s*)?(?:{RX_YEAR.pattern}|{RX_PRESENT.pattern})",
     re.I
 )
 
 RX_SINCE = re.compile(
-    rf"\b(?:depuis|since)\s+(?:(?:{MONTHS_FR}|{MONTHS_EN})\s*)?(?:{RX_YEAR.pattern}|{RX_MMYYYY.pattern})",
+    rf"\b(?:depuis|since)\s+(?:{MONTHS}\s*)?(?:{RX_YEAR.pattern}|{RX_MMYYYY.pattern})",
     re.I
 )
 
@@ -57,52 +311,187 @@ def clean_common(s: str) -> str:
     t = RX_MULTI_SPACE.sub(" ", t)
     return t.strip()
 
-def lines_nonempty(text: str) -> List[str]:
-    return [l.strip() for l in clean_common(text).split("\n") if l.strip()]
+def has_letters(s: str) -> bool:
+    """False for blank, punctuation-only or numeric-only text: NER finds nothing there."""
+    return any(c.isalpha() for c in s)
+
+def clean_line(line: str) -> str:
+    """clean_common() for a single line (no newline handling)."""
+    t = RX_MAILTO.sub("", line)
+    t = RX_MULTI_SPACE.sub(" ", t)
+    return t.strip()
+
+def lines_nonempty(text: str) -> Iterator[str]:
+    """Lazily yield cleaned, non-empty lines (wrap in list() if you need them all)."""
+    # only "\n" breaks lines and "\r" is dropped, as clean_common() does
+    # (splitlines() would also split on lone "\r", "\x0c", "\u2028"...)
+    for l in (text or "").split("\n"):
+        if "\r" in l:
+            l = l.replace("\r", "")
+        if not l or l.isspace():
+            continue
+        l = clean_line(l)
+        if l:
+            yield l
+
+# "/", ",", ";" and " et " all separate group hints: fold them onto "/" and split
+GROUP_SEP_TRANS = str.maketrans({",": "/", ";": "/"})
+
+def split_group_hints(inside: str) -> List[str]:
+    t = inside.translate(GROUP_SEP_TRANS).replace(" et ", "/")
+    return [x.strip() for x in t.split("/") if x.strip()]
+
+def find_paren_group(s: str, start: int = 0) -> Optional[Tuple[int, int]]:
+    r"""
+    Indices of the next "(" and its first ")" at or after start, on a single line
+    (like the former r"\((.*?)\)": a group never spans a "\n", e.g. from a company_hint).
+    """
+    while True:
+        l = s.find("(", start)
+        if l < 0:
+            return None
+        r = s.find(")", l + 1)
+        if r < 0:
+            return None
+        nl = s.find("\n", l + 1, r)
+        if nl < 0:
+            return l, r
+        start = nl + 1
 
 def parse_group_hints(company_part: str) -> List[str]:
-    m = RX_PARENS.search(company_part or "")
-    if not m:
+    if not company_part:
+        return []
+    g = find_paren_group(company_part)
+    if g is None:
         return []
-    inside = m.group(1)
-    hints = [x.strip() for x in re.split(r"[/,;]| et ", inside) if x.strip()]
+    hints = split_group_hints(company_part[g[0] + 1:g[1]])
     return hints[:10]
 
 def clean_company_query(company_part: str) -> str:
-    q = re.sub(r"\s*\(.*?\)\s*", " ", company_part or "").strip()
+    # drop every "(...)" group (unclosed "(" is kept as is)
+    s = company_part or ""
+    parts: List[str] = []
+    i = 0
+    while True:
+        g = find_paren_group(s, i)
+        if g is None:
+            break
+        parts.append(s[i:g[0]])
+        parts.append(" ")
+        i = g[1] + 1
+    parts.append(s[i:])
+    q = "".join(parts).strip()
     q = RX_MULTI_SPACE.sub(" ", q)
     return q
 
-def spacy_best_org(text: str) -> Optional[str]:
-    if not text:
+async def spacy_best_org(text: str) -> Optional[str]:
+    # normalized text is both the cache key and the NER input (NER is case-sensitive: no lowercasing)
+    text = RX_MULTI_SPACE.sub(" ", (text or "").strip())
+    # short queries ("Google", "Société Générale") are already the org name:
+    # NER would hand them back unchanged, skip the forward pass
+    if len(text) < 20 or text.count(" ") < 2:
         return None
-    doc = nlp(text)
-    orgs = [e.text.strip() for e in doc.ents if e.label_ == "ORG"]
-    if not orgs:
+    cached = org_cache.get(text)
+    if cached is not _MISS:
+        return cached
+    doc = await org_batcher.submit(text)
+    # prefer longest span (often the real org name); one pass, no intermediate list
+    best: Optional[str] = None
+    best_len = 0
+    for e in doc.ents:
+        if e.label_ == "ORG":
+            t = e.text.strip()
+            if len(t) > best_len:
+                best, best_len = t, len(t)
+    org_cache.put(text, best)
+    return best
+
+# Every RX_DATE_RANGE / RX_SINCE match holds a 19xx/20xx year and one of these
+# (lowercased) markers: plain substring checks rule out most lines before the regexes run.
+DATE_MARKERS = ("-", "–", "—", "to", "à", "au", "jusqu", "depuis", "since")
+
+def has_date_markers(s: str) -> bool:
+    if "19" not in s and "20" not in s:
+        return False
+    t = s.lower()
+    return any(m in t for m in DATE_MARKERS)
+
+def find_date_range(s: str) -> Optional[Tuple[int, int]]:
+    """Find a date-ish range in a string, return its (start, end) span (no parsing)."""
+    if not s or not has_date_markers(s):
         return None
-    # prefer longest span (often the real org name)
-    return max(orgs, key=len)
+    m = RX_DATE_RANGE.search(s) or RX_SINCE.search(s)
+    # allow MM/YYYY ranges like "06/2021 - présent" to be caught by DATE_RANGE sometimes,
+    # else just return first MMYYYY occurrence if present-ish elsewhere (weak)
+    return m.span() if m else None
 
 def detect_date_range_raw(s: str) -> Optional[str]:
     """Find a date-ish range in a string, return raw substring (no parsing)."""
-    if not s:
-        return None
-    m = RX_DATE_RANGE.search(s)
+    span = find_date_range(s)
+    return s[span[0]:span[1]].strip() if span else None
+
+def _slice_wo_span(s: str, start: int, end: int, span: Optional[Tuple[int, int]]) -> str:
+    """s[start:end] stripped, with span cut out (and the gap reduced to one space) if it lies inside."""
+    if span and start <= span[0] and span[1] <= end:
+        return f"{s[start:span[0]].rstrip()} {s[span[1]:end].lstrip()}".strip()
+    return s[start:end].strip()
+
+ParsedCtx = namedtuple(
+    "ParsedCtx",
+    "left right candidate_for_company company_part company_query company_group_hints"
+    " location_raw date_range_raw title_raw",
+)
+
+def split_ctx_line(ctx: str, title_hint: str = "") -> ParsedCtx:
+    """
+    Split a cleaned context line ('dates : Title | Company - Location', 'Company - Location | dates', ...)
+    with one date search and index slicing.
+    - date range is detected on the whole line (more robust), then cut out of the parts
+    - pipe: left is "main", right is "tail"; company + location mostly live in right,
+      but some CVs do "Company - Location | dates" so fall back to left
+    - title: after ":" in left (minus dates), else title_hint, else left itself
+    - company: query without (...) groups + the group hints found inside them
+    """
+    n = len(ctx)
+    span = find_date_range(ctx)
+    date_range_raw = ctx[span[0]:span[1]].strip() if span else None
+
+    pipe = ctx.find("|")
+    if pipe >= 0:
+        left_end, right_start = pipe, pipe + 1
+    else:
+        left_end, right_start = n, n
+    left = ctx[:left_end].strip()
+    right = ctx[right_start:].strip()
+
+    if right:
+        candidate = _slice_wo_span(ctx, right_start, n, span)
+    else:
+        candidate = _slice_wo_span(ctx, 0, left_end, span)
+
+    # If candidate still contains '-', split company/location
+    m = RX_DASH_SPLIT.search(candidate)
     if m:
-        return m.group("range").strip()
-    m2 = RX_SINCE.search(s)
-    if m2:
-        return m2.group(0).strip()
-    # allow MM/YYYY ranges like "06/2021 - présent" to be caught by DATE_RANGE sometimes,
-    # else just return first MMYYYY occurrence if present-ish elsewhere (weak)
-    return None
+        company_part = candidate[:m.start()].strip()
+        location_raw: Optional[str] = candidate[m.end():].strip()
+    else:
+        company_part = candidate
+        location_raw = None
+
+    title_raw: Optional[str] = None
+    if left:
+        left_wo_date = _slice_wo_span(ctx, 0, left_end, span)
+        colon = left_wo_date.find(":")
+        if colon >= 0:
+            title_raw = left_wo_date[colon + 1:].strip()
+        else:
+            title_raw = title_hint or left_wo_date or None
 
-def split_company_location(left_part: str) -> (str, Optional[str]):
-    """Split on ' - ' if present; keep raw."""
-    parts = RX_DASH_SPLIT.split(left_part, maxsplit=1)
-    company_part = parts[0].strip() if parts else left_part.strip()
-    location_raw = parts[1].strip() if len(parts) > 1 else None
-    return company_part, location_raw
+    return ParsedCtx(
+        left, right, candidate,
+        company_part, clean_company_query(company_part), parse_group_hints(company_part),
+        location_raw, date_range_raw, title_raw,
+    )
 
 def split_title_company(ctx: str) -> (Optional[str], Optional[str]):
     """
@@ -134,16 +523,22 @@ def get_ctx_line(payload_raw: str, meta: Dict[str, Any]) -> (str, str, List[str]
     used_hints: List[str] = []
     strat = "unknown"
 
-    ls = lines_nonempty(payload_raw)
-    if not ls:
+    # lazy: only the lines up to the first heading are ever cleaned
+    it = lines_nonempty(payload_raw)
+    first_line = next(it, None)
+    if first_line is None:
         return "", "empty", used_hints
 
-    headings = [l for l in ls if l.startswith("#")]
-    if headings:
-        ctx = strip_md(headings[0])
+    if first_line[0] == "#":
+        heading: Optional[str] = first_line
+    else:
+        heading = next((l for l in it if l[0] == "#"), None)
+
+    if heading is not None:
+        ctx = strip_md(heading)
         strat = "heading_first"
     else:
-        ctx = ls[0]
+        ctx = first_line
         strat = "first_non_empty"
 
     ctx = clean_common(ctx)
@@ -190,6 +585,10 @@ def health():
     return {
         "status": "ok",
         "model": MODEL,
+        "pipeline": nlp.pipe_names,
+        "max_chars": MAX_CHARS,
+        "gpu": USE_GPU,
+        "org_cache": org_cache.info(),
         "loaded_at": LOAD_TS,
     }
 
@@ -200,7 +599,9 @@ def debug_ents(payload: dict):
         raise HTTPException(status_code=400, detail="text must be a string")
     if len(text) > MAX_CHARS:
         raise HTTPException(status_code=413, detail=f"text too large (>{MAX_CHARS} chars)")
-    doc = nlp(text)
+    if not has_letters(text):
+        return []
+    doc = anyio.from_thread.run(batcher.submit, text)
     return [{"text": e.text, "label": e.label_, "start": e.start_char, "end": e.end_char} for e in doc.ents]
 
 @app.post("/v1/xp/parse")
@@ -215,6 +616,9 @@ def xp_parse(payload: dict):
     """
     raw = payload.get("raw", "")
     xp_id = payload.get("id")
+    if isinstance(xp_id, int) and not -(2**63) <= xp_id < 2**64:
+        # echoed as sent, except ints orjson can't encode (beyond 64 bits)
+        xp_id = str(xp_id)
     meta = payload.get("meta") or {}
     debug = bool(payload.get("debug", DEBUG_DEFAULT))
 
@@ -231,64 +635,14 @@ def xp_parse(payload: dict):
 
     ctx = clean_common(ctx_line)
 
-    # Split pipe => right part tends to be date or company depending on formats.
-    # We'll interpret conservatively:
-    # - If pipe exists, left is "main", right is "tail"
-    # - Try detect date in whole ctx first (more robust)
-    date_range_raw = detect_date_range_raw(ctx)
-
-    left, right = None, None
-    if "|" in ctx:
-        parts = [p.strip() for p in ctx.split("|", 1)]
-        left = parts[0]
-        right = parts[1] if len(parts) > 1 else ""
-    else:
-        left = ctx
-        right = ""
-
-    # Company + location mostly live in right if "Title | Company - Location"
-    # But some CVs do "Company - Location | dates"
-    company_part = ""
-    location_raw = None
-
-    # Heuristic: if right exists and looks like org-ish, prefer it for company parsing
-    candidate_for_company = right or left
-
-    # Remove date range substring from candidate when possible (keep raw date separately)
-    if date_range_raw and candidate_for_company:
-        candidate_for_company = candidate_for_company.replace(date_range_raw, " ").strip()
-        candidate_for_company = RX_MULTI_SPACE.sub(" ", candidate_for_company)
-
-    # If candidate still contains '-', split company/location
-    company_part, location_raw = split_company_location(candidate_for_company)
-
-    # Title detection: try after ":" in left if left includes date-ish
-    title_raw = None
-    if left:
-        # remove date fragment from left to isolate title candidates
-        left_wo_date = left
-        if date_range_raw:
-            left_wo_date = left_wo_date.replace(date_range_raw, " ").strip()
-            left_wo_date = RX_MULTI_SPACE.sub(" ", left_wo_date)
-
-        if ":" in left_wo_date:
-            # take after colon
-            title_raw = left_wo_date.split(":", 1)[1].strip()
-        else:
-            # fallback to meta hint
-            th = str(meta.get("title_hint", "")).strip()
-            if th:
-                title_raw = th
-            else:
-                # last resort: if left looks like pure title
-                title_raw = left_wo_date.strip() if left_wo_date else None
-
-    # Company query + group hints
-    company_group_hints = parse_group_hints(company_part)
-    company_query = clean_company_query(company_part)
+    p = split_ctx_line(ctx, str(meta.get("title_hint", "")).strip())
+    date_range_raw = p.date_range_raw
+    title_raw = p.title_raw
+    company_query = p.company_query
 
     # spaCy refine ORG
-    sp_org = spacy_best_org(company_query)
+    # on the loop thread: org_cache is only ever touched from there
+    sp_org = anyio.from_thread.run(spacy_best_org, company_query)
     if sp_org and len(sp_org) >= 2:
         company_query = sp_org
 
@@ -307,10 +661,10 @@ def xp_parse(payload: dict):
         "id": xp_id,
         "ctx_line": ctx,
         "title_raw": title_raw,
-        "company_display": company_part.strip(),
+        "company_display": p.company_part,
         "company_query": company_query,
-        "company_group_hints": company_group_hints,
-        "location_raw": location_raw,
+        "company_group_hints": p.company_group_hints,
+        "location_raw": p.location_raw,
         "date_range_raw": date_range_raw,
         "confidence": conf,
         "warnings": warnings,
@@ -320,9 +674,9 @@ def xp_parse(payload: dict):
         out["debug"] = {
             "ctx_line_strategy": ctx_strategy,
             "used_meta_hints": used_hints,
-            "left": left,
-            "right": right,
-            "candidate_for_company": candidate_for_company,
+            "left": p.left,
+            "right": p.right,
+            "candidate_for_company": p.candidate_for_company,
         }
 
     return out
@@ -355,24 +709,36 @@ def xp_extract_simple(payload: dict):
     
     # Clean input
     text = clean_common(text)
+
+    # Noise (punctuation / numbers only): nothing to tag, skip the pipeline
+    if not has_letters(text):
+        result = {"orgs": [], "dates": [], "locations": [], "job_title": ""}
+        if debug:
+            result["debug"] = {
+                "all_entities": [],
+                "tagged_token_count": 0,
+                "total_token_count": 0,
+                "nlp_skipped": "no_letters",
+            }
+        return result
     
     # SpaCy NER
-    doc = nlp(text)
+    doc = anyio.from_thread.run(batcher.submit, text)
     
     orgs = [e.text.strip() for e in doc.ents if e.label_ == "ORG"]
     dates = [e.text.strip() for e in doc.ents if e.label_ == "DATE"]
     locations = [e.text.strip() for e in doc.ents if e.label_ == "LOC"]
     
-    # Build set of tagged token indices
-    tagged_indices = set()
+    # Tagged-token bitmap (one byte per token, indexed by token.i)
+    tagged = bytearray(len(doc))
     for ent in doc.ents:
         for i in range(ent.start, ent.end):
-            tagged_indices.add(i)
+            tagged[i] = 1
     
     # Extract job title = non-tagged, non-stop, non-punct tokens
     job_title_tokens = [
         token.text for token in doc 
-        if token.i not in tagged_indices 
+        if not tagged[token.i] 
         and not token.is_punct 
         and not token.is_stop
         and token.text.strip()
@@ -392,7 +758,7 @@ def xp_extract_simple(payload: dict):
                 {"text": e.text, "label": e.label_, "start": e.start_char, "end": e.end_char} 
                 for e in doc.ents
             ],
-            "tagged_token_count": len(tagged_indices),
+            "tagged_token_count": tagged.count(1),
             "total_token_count": len(doc),
         }
     